@@ -1,58 +1,123 @@
 import os
 import argparse
+import io
+import logging
+import mmap
 import re
-from PyPDF2 import PdfReader, PdfWriter
-from collections import defaultdict
+import string
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import IndirectObject
+from collections import defaultdict, namedtuple
+from operator import itemgetter
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# 单个书签记录：标题、起始页（从 0 开始）、层级
+Bookmark = namedtuple('Bookmark', ['title', 'page_num', 'level'])
+
+class _SafeFilenameTable(dict):
+    """str.translate table filled on demand: keep alphanumerics, ' ', '-', '_'; map the rest to '_'"""
+    def __init__(self, preload=()):
+        super().__init__()
+        for codepoint in preload:
+            self.__missing__(codepoint)
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        value = char if char.isalnum() or char in ' -_' else '_'
+        self[codepoint] = value
+        return value
+
+# ASCII 部分在导入时预先填好，常见标题无需走 __missing__
+_SAFE_FILENAME_TABLE = _SafeFilenameTable(preload=range(128))
+
+# 输出文件写缓冲大小（1 MiB），减少 writer.write 的小块系统调用
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# 超过该大小（64 MiB）的输入改用内存映射，避免每个进程各复制一份文件内容
+MMAP_THRESHOLD = 64 << 20
+
+# 书签标题格式：(可能的首字符, 正则, 层级, 格式类型)，按匹配优先级排列
+# 层级为 None 表示按标题中的 '.' 个数计算；首字符 '0' 代表任意十进制数字
+_TITLE_PATTERNS = (
+    ('0', r'^(\d+\.)*\d+', None, 'numeric'),  # 1.1, 1.2, etc.
+    # 中文章节格式
+    ('第', r'^第[一二三四五六七八九十百千]+章', 1, 'text'),  # 第一章
+    ('第', r'^第[一二三四五六七八九十百千]+节', 2, 'text'),  # 第一节
+    ('第', r'^第[一二三四五六七八九十百千]+小节', 3, 'text'),  # 第一小节
+    ('一二三四五六七八九十', r'^[一二三四五六七八九十]、', 1, 'text'),  # 一、二、三、
+    ('（', r'^（[一二三四五六七八九十]）', 2, 'text'),  # （一）（二）
+    ('(', r'^\([1-9][0-9]*\)', 2, 'text'),  # (1)(2)
+    ('0', r'^[1-9][0-9]*\. ', 1, 'text'),  # 1. 2.
+    (string.ascii_letters, r'^[a-zA-Z]\. ', 2, 'text'),  # a. b.
+    # 数字和文字的混合格式
+    ('0', r'^\d+\s*[、.\s]?\s*[第章节]', 1, 'mixed'),
+    # 其他常见格式
+    ('前', r'^前言$', 1, 'special'),
+    ('引', r'^引言$', 1, 'special'),
+    ('简', r'^简介$', 1, 'special'),
+    ('附', r'^附录[A-Za-z]?', 1, 'special'),
+    ('总', r'^总结$', 1, 'special'),
+    ('参', r'^参考文献$', 1, 'special'),
+)
+
+def _build_pattern_dispatch(patterns):
+    """
+    Index the title patterns by first character
+    Returns: {char: (regex, {group_name: (level, pattern_type)})}
+    All candidates for a character are fused into one alternation of named
+    groups (in priority order), so a single match call classifies the title.
+    """
+    candidates = {}
+    for index, (first_chars, pattern, level, pattern_type) in enumerate(patterns):
+        for char in first_chars:
+            candidates.setdefault(char, []).append((f'p{index}', pattern, level, pattern_type))
+
+    dispatch = {}
+    fused_cache = {}  # 候选相同的字符（如所有字母）共用同一个编译结果
+    for char, entries in candidates.items():
+        key = tuple(entries)
+        if key not in fused_cache:
+            regex = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern, _, _ in entries))
+            fused_cache[key] = (regex, {name: (level, pattern_type) for name, _, level, pattern_type in entries})
+        dispatch[char] = fused_cache[key]
+    return dispatch
+
+# 按首字符直接定位候选正则，不再逐个尝试全部格式
+_PATTERN_DISPATCH = _build_pattern_dispatch(_TITLE_PATTERNS)
+
+@lru_cache(maxsize=4096)
 def detect_bookmark_pattern(title):
     """
     Detect the pattern of bookmark title and return its level
     Returns: (level, pattern_type)
     pattern_type: 'numeric' or 'text' or 'mixed'
+    Results are cached per title: the numeric level counts every '.' in the
+    title, so the whole title (not just its leading token) is the key.
     """
-    # 检查数字格式 (1.1, 1.2, etc.)
-    numeric_pattern = r'^(\d+\.)*\d+'
-    if re.match(numeric_pattern, title.strip()):
-        level = len(title.strip().split('.'))
-        return level, 'numeric'
-    
-    # 检查中文章节格式
-    chapter_patterns = {
-        r'^第[一二三四五六七八九十百千]+章': 1,  # 第一章
-        r'^第[一二三四五六七八九十百千]+节': 2,  # 第一节
-        r'^第[一二三四五六七八九十百千]+小节': 3,  # 第一小节
-        r'^[一二三四五六七八九十]、': 1,  # 一、二、三、
-        r'^（[一二三四五六七八九十]）': 2,  # （一）（二）
-        r'^\([1-9][0-9]*\)': 2,  # (1)(2)
-        r'^[1-9][0-9]*\. ': 1,  # 1. 2.
-        r'^[a-zA-Z]\. ': 2,  # a. b.
-    }
-    
-    for pattern, level in chapter_patterns.items():
-        if re.match(pattern, title.strip()):
-            return level, 'text'
-    
-    # 检查是否包含数字和文字的混合格式
-    mixed_pattern = r'^\d+\s*[、.\s]?\s*[第章节]'
-    if re.match(mixed_pattern, title.strip()):
-        return 1, 'mixed'
-    
-    # 检查其他常见格式
-    special_patterns = {
-        r'^前言$': 1,
-        r'^引言$': 1,
-        r'^简介$': 1,
-        r'^附录[A-Za-z]?': 1,
-        r'^总结$': 1,
-        r'^参考文献$': 1,
-    }
-    
-    for pattern, level in special_patterns.items():
-        if re.match(pattern, title.strip()):
-            return level, 'special'
+    # 只去除一次空白：左侧去除的结果同时用于计算缩进
+    lstripped = title.lstrip()
+    stripped = lstripped.rstrip()
+    first = stripped[:1]
+    if first.isdecimal():
+        first = '0'
+
+    candidates = _PATTERN_DISPATCH.get(first)
+    if candidates is not None:
+        regex, results = candidates
+        match = regex.match(stripped)
+        if match:
+            level, pattern_type = results[match.lastgroup]
+            if level is None:
+                level = stripped.count('.') + 1
+            return level, pattern_type
     
     # 如果没有找到匹配的模式，尝试通过缩进或其他特征判断
-    indent_level = len(title) - len(title.lstrip())
+    indent_level = len(title) - len(lstripped)
     if indent_level > 0:
         return (indent_level // 2) + 1, 'indent'
     
@@ -75,149 +140,235 @@ def analyze_bookmark_structure(bookmarks):
 def extract_bookmarks_with_pages(reader):
     """Extract all bookmarks with their page numbers and levels"""
     def process_outline(outline):
+        # 使用显式栈迭代遍历，避免深层书签导致递归过深
         results = []
-        if isinstance(outline, list):
-            for item in outline:
-                results.extend(process_outline(item))
-        elif isinstance(outline, dict):
-            title = outline.get('/Title', '')
-            if '/Page' in outline:  # This is a page reference
-                page_ref = outline['/Page']
-                try:
-                    if hasattr(page_ref, 'get_object'):
-                        page_num = reader.get_page_number(page_ref.get_object())
-                    else:
-                        page_num = reader.get_page_number(page_ref)
-                    
-                    level, _ = detect_bookmark_pattern(title)
-                    results.append((title, page_num, level))
-                except Exception as e:
-                    print(f"Warning: Error processing page reference for '{title}': {str(e)}")
-            
-            # Process any children
-            if '/First' in outline:
-                child = outline['/First']
-                while child:
-                    results.extend(process_outline(child))
-                    child = child.get('/Next', None)
-        
+        stack = [outline]
+        seen = set()  # 损坏的 /First、/Next 链可能成环，已访问的节点不再处理
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+            elif isinstance(node, dict):
+                if id(node) in seen:
+                    continue
+                seen.add(id(node))
+                title = node.get('/Title', '')
+                if '/Page' in node:  # This is a page reference
+                    page_ref = node['/Page']
+                    try:
+                        # 间接引用本身即可作为键，无需解析出页面对象；
+                        # 直接内嵌的字典没有 indirect_reference
+                        if isinstance(page_ref, IndirectObject):
+                            ref = page_ref
+                        else:
+                            ref = getattr(page_ref, 'indirect_reference', None)
+                        page_num = page_index.get((ref.idnum, ref.generation)) if ref is not None else None
+                        if page_num is None:
+                            # 映射中找不到（如 generation 不一致或没有引用）时才退回到 reader 的查找
+                            page_num = reader.get_page_number(page_ref.get_object())
+                        if page_num is None:
+                            raise ValueError("page is not part of this document")
+
+                        level, _ = detect_bookmark_pattern(title)
+                        results.append(Bookmark(title, page_num, level))
+                    except Exception as e:
+                        logger.warning("Warning: Error processing page reference for '%s': %s", title, e)
+
+                # Process any children (pushed in reverse to keep document order)
+                if '/First' in node:
+                    children = []
+                    chain = set()
+                    child = node['/First']
+                    while child and id(child) not in chain:
+                        children.append(child)
+                        chain.add(id(child))
+                        child = child.get('/Next', None)
+                    stack.extend(reversed(children))
+
         return results
 
+    # 预先建立页面引用 (idnum, generation) -> 页码的映射，整个运行只遍历一次页面树
+    page_index = {}
+    for i, page in enumerate(reader.pages):
+        ref = page.indirect_reference
+        page_index[(ref.idnum, ref.generation)] = i
+
     try:
         outline = reader.outline
         if isinstance(outline, (list, dict)):
-            bookmarks = process_outline(outline)
-            # 分析书签结构
-            main_pattern = analyze_bookmark_structure(bookmarks)
-            print(f"Detected main bookmark pattern: {main_pattern}")
-            return bookmarks
+            return process_outline(outline)
         else:
-            print("Warning: Outline structure not recognized")
+            logger.warning("Warning: Outline structure not recognized")
             return []
     except Exception as e:
-        print(f"Warning: Error processing outline: {str(e)}")
+        logger.warning("Warning: Error processing outline: %s", e)
         return []
 
-def organize_by_level(bookmarks, max_depth=None):
-    """Organize bookmarks by their hierarchy level"""
+def _with_end_pages(starts, total_pages):
+    """Turn ordered (title, start_page) pairs into (title, start_page, end_page) in one pass"""
+    next_starts = [start_page for _, start_page in starts[1:]]
+    next_starts.append(total_pages)
+    return [(title, start_page, min(end_page, total_pages))
+            for (title, start_page), end_page in zip(starts, next_starts)]
+
+def organize_by_level(bookmarks, max_depth=None, main_pattern=None, *, total_pages):
+    """
+    Organize bookmarks by their hierarchy level
+    Returns: [(title, start_page, end_page)], end_page exclusive (next section's start or total_pages)
+    main_pattern: result of analyze_bookmark_structure, only used for debug output
+    """
     if not bookmarks:
         return []
 
-    # 分析书签结构
-    main_pattern = analyze_bookmark_structure(bookmarks)
-    print(f"Using bookmark pattern: {main_pattern}")
+    if main_pattern is not None:
+        logger.debug("Using bookmark pattern: %s", main_pattern)
 
     if not max_depth:
-        return [(title, page_num) for title, page_num, _ in bookmarks]
+        return _with_end_pages([(title, page_num) for title, page_num, _ in bookmarks], total_pages)
 
     # 按页码排序确保顺序正确
-    bookmarks = sorted(bookmarks, key=lambda x: x[1])
-    
-    sections = defaultdict(list)
-    current_parent = None
+    bookmarks = sorted(bookmarks, key=itemgetter(1))
     
+    # 只需记录各章节的起始页，结束页由下一章节的起始页决定；
+    # 同名章节只保留第一次出现的位置
+    starts = []
+    seen_titles = set()
     for title, page_num, level in bookmarks:
-        if level <= max_depth:
-            current_parent = title
-            sections[current_parent].append((page_num, page_num))
-        elif current_parent:
-            if sections[current_parent]:
-                sections[current_parent][-1] = (sections[current_parent][-1][0], page_num)
+        if level <= max_depth and title not in seen_titles:
+            seen_titles.add(title)
+            starts.append((title, page_num))
 
-    result = []
-    for title in sorted(sections.keys(), key=lambda x: sections[x][0][0]):
-        result.append((title, sections[title][0][0]))
-    
-    return result
+    return _with_end_pages(starts, total_pages)
+
+# 每个工作进程各自打开一次源 PDF（reader 不能跨进程传递）
+_worker_source = None
+
+def _open_source(input_pdf_path):
+    """Open the source PDF and materialize its page list once: (reader, pages)"""
+    # 一次性读入内存（大文件则内存映射），解析时的大量 seek/read 不再产生系统调用
+    with open(input_pdf_path, 'rb') as input_file:
+        if os.fstat(input_file.fileno()).st_size > MMAP_THRESHOLD:
+            stream = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            stream = io.BytesIO(input_file.read())
+    reader = PdfReader(stream)
+    return reader, list(reader.pages)
+
+def _init_worker(input_pdf_path):
+    """Open the source PDF once in each worker process"""
+    global _worker_source
+    _worker_source = _open_source(input_pdf_path)
+
+def _write_section(task, source=None):
+    """Write one section to its own PDF file, return an error message or None"""
+    start_page, end_page, output_path = task
+    _, pages = source or _worker_source
 
-def split_pdf_by_bookmarks(input_pdf_path, output_dir="split_pdfs", max_depth=None):
-    """Split a PDF file according to its bookmarks"""
+    # 逐页加入已物化的页面列表；不用 writer.append，它每次都会处理全部命名目标
+    writer = PdfWriter()
+    for page in pages[start_page:end_page]:
+        writer.add_page(page)
+
+    try:
+        with open(output_path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+            writer.write(output_file)
+    except Exception as e:
+        return str(e)
+    return None
+
+def split_pdf_by_bookmarks(input_pdf_path, output_dir="split_pdfs", max_depth=None, max_workers=1):
+    """
+    Split a PDF file according to its bookmarks
+    max_workers: number of processes writing sections (default: 1, no pool; None uses the CPU count)
+    """
     os.makedirs(output_dir, exist_ok=True)
     
     # 统计计数器
     non_empty_count = 0
-    empty_count = 0
-    empty_chapters = []
     
-    print(f"Opening PDF: {input_pdf_path}")
+    logger.info("Opening PDF: %s", input_pdf_path)
     try:
-        reader = PdfReader(input_pdf_path)
-        print(f"PDF loaded successfully: {len(reader.pages)} pages")
+        reader, pages = _open_source(input_pdf_path)
+        n_pages = len(pages)
+        logger.info("PDF loaded successfully: %d pages", n_pages)
     except Exception as e:
-        print(f"Error opening PDF: {str(e)}")
+        logger.error("Error opening PDF: %s", e)
         return
     
-    print("Extracting bookmarks...")
+    logger.info("Extracting bookmarks...")
     bookmarks = extract_bookmarks_with_pages(reader)
     
     if not bookmarks:
-        print("No bookmarks found in the PDF!")
+        logger.warning("No bookmarks found in the PDF!")
         return
     
-    print(f"Found {len(bookmarks)} bookmarks")
+    logger.info("Found %d bookmarks", len(bookmarks))
     
-    organized_bookmarks = organize_by_level(bookmarks, max_depth)
-    print(f"Processing {len(organized_bookmarks)} sections")
+    # 分析书签结构只做一次，且仅用于调试输出
+    main_pattern = None
+    if logger.isEnabledFor(logging.DEBUG):
+        main_pattern = analyze_bookmark_structure(bookmarks)
+        logger.debug("Detected main bookmark pattern: %s", main_pattern)
     
-    for i, (title, start_page) in enumerate(organized_bookmarks):
-        end_page = organized_bookmarks[i + 1][1] if i < len(organized_bookmarks) - 1 else len(reader.pages)
-        
-        # 计算页数
-        num_pages = end_page - start_page
-        
-        # 跳过空白文档
-        if num_pages <= 0:
-            empty_count += 1
-            empty_chapters.append(title)
-            continue
-        
-        writer = PdfWriter()
-        
-        for page_num in range(start_page, end_page):
-            if page_num < len(reader.pages):
-                writer.add_page(reader.pages[page_num])
-        
-        safe_title = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in title)
-        safe_title = safe_title[:150]
-        output_path = os.path.join(output_dir, f"{safe_title}.pdf")
+    organized_bookmarks = organize_by_level(bookmarks, max_depth, main_pattern, total_pages=n_pages)
+    logger.info("Processing %d sections", len(organized_bookmarks))
+    
+    # 一次性筛掉空白章节（0 页）
+    empty_chapters = [title for title, start_page, end_page in organized_bookmarks if end_page <= start_page]
+    sections = [section for section in organized_bookmarks if section[2] > section[1]]
+    empty_count = len(empty_chapters)
+    
+    # 输出目录前缀只拼接一次（自带结尾分隔符）
+    out_prefix = os.path.join(output_dir, '')
+    names = []
+    tasks = []
+    used_names = set()
+    for title, start_page, end_page in sections:
+        base_title = title.translate(_SAFE_FILENAME_TABLE)[:150]
+        # 同名章节（如各章的“小结”）加数字后缀，保证每个任务写入不同的文件
+        safe_title = base_title
+        suffix = 2
+        while safe_title.lower() in used_names:
+            safe_title = f"{base_title}_{suffix}"
+            suffix += 1
+        used_names.add(safe_title.lower())
+        output_path = f"{out_prefix}{safe_title}.pdf"
         
-        print(f"Creating: {safe_title}.pdf ({num_pages} pages)")
-        try:
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
-            non_empty_count += 1
-        except Exception as e:
-            print(f"Error saving '{safe_title}.pdf': {str(e)}")
+        names.append((safe_title, end_page - start_page))
+        tasks.append((start_page, end_page, output_path))
+
+    # 各章节互相独立，使用进程池并行写出
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(input_pdf_path,))
+        # 分批派发任务，减少进程间通信次数；每个进程约分到 4 批以保持负载均衡
+        chunksize = max(1, len(tasks) // (workers * 4))
+        results = executor.map(_write_section, tasks, chunksize=chunksize)
+    else:
+        executor = None
+        results = (_write_section(task, (reader, pages)) for task in tasks)
+
+    try:
+        for (safe_title, num_pages), error in zip(names, results):
+            logger.info("Creating: %s.pdf (%d pages)", safe_title, num_pages)
+            if error is None:
+                non_empty_count += 1
+            else:
+                logger.error("Error saving '%s.pdf': %s", safe_title, error)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # 打印统计信息
-    print("\nProcessing Summary:")
-    print(f"Total sections processed: {len(organized_bookmarks)}")
-    print(f"Non-empty documents created: {non_empty_count}")
-    print(f"Empty sections skipped: {empty_count}")
+    logger.info("\nProcessing Summary:")
+    logger.info("Total sections processed: %d", len(organized_bookmarks))
+    logger.info("Non-empty documents created: %d", non_empty_count)
+    logger.info("Empty sections skipped: %d", empty_count)
     if empty_count > 0:
-        print("\nSkipped sections (0 pages):")
+        logger.info("\nSkipped sections (0 pages):")
         for chapter in empty_chapters:
-            print(f"- {chapter}")
+            logger.info("- %s", chapter)
 
 def main():
     parser = argparse.ArgumentParser(description='Split PDF file according to its bookmarks')
@@ -227,20 +378,25 @@ def main():
     parser.add_argument('-d', '--depth', type=int, default=None,
                         help='Maximum depth level for splitting (e.g., 2 for splitting at second level headers). '
                              'Default: None (use all levels)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of processes used to write the split PDFs. '
+                             'Default: None (use all CPU cores)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Show debug output, such as the detected bookmark pattern')
     
     args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(message)s', stream=sys.stdout)
     
     if not os.path.exists(args.input_pdf):
-        print(f"Error: Could not find input file '{args.input_pdf}'")
+        logger.error("Error: Could not find input file '%s'", args.input_pdf)
         return
     
     try:
-        split_pdf_by_bookmarks(args.input_pdf, args.output_dir, args.depth)
-        print(f"\nPDF splitting complete! Check the '{args.output_dir}' directory for the output files.")
+        split_pdf_by_bookmarks(args.input_pdf, args.output_dir, args.depth, args.jobs)
+        logger.info("\nPDF splitting complete! Check the '%s' directory for the output files.", args.output_dir)
     except Exception as e:
-        print(f"Error processing PDF: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing PDF: %s", e)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file